@@ -8,8 +8,10 @@ This version properly parses chapter numbers from the text (e.g., "17." at start
 
 import re
 import json
+import xml.etree.ElementTree as ET
+from bisect import bisect_left
+from itertools import accumulate
 from pathlib import Path
-from html import unescape
 
 TEI_PATH = Path(__file__).parent.parent.parent / 'tjrrsqn4dwmgep.tei.xml'
 OUTPUT_DIR = Path(__file__).parent.parent / 'public' / 'data'
@@ -19,79 +21,143 @@ BOOK_TITLES = {
     5: "Terpsichore", 6: "Erato", 7: "Polymnia", 8: "Urania", 9: "Calliope"
 }
 
-def extract_text_from_tei():
-    """Extract raw text content from TEI XML, preserving structure."""
-    with open(TEI_PATH, 'r', encoding='utf-8') as f:
-        content = f.read()
-
-    # Find the body content
-    body_match = re.search(r'<body>(.*?)</body>', content, re.DOTALL)
-    if not body_match:
-        raise ValueError("Could not find body in TEI")
-
-    body = body_match.group(1)
+BOOK_RE = re.compile(r'Book (\d+)')
+# Chapter markers: sentence-ending punctuation (incl. curly quotes and
+# footnote digits), a space, then a 1-3 digit number and a period.
+# The pattern starts with the literal space and checks the punctuation with
+# a lookbehind afterwards, so the engine can jump straight to candidate
+# spaces instead of trying the lookbehind at every position.
+CHAPTER_RE = re.compile(r' (?<=[.!?"\':;,\u201c\u201d0-9] )(\d{1,3})\.')
+
+def local_name(tag):
+    """Strip the namespace from an ElementTree tag, e.g. '{ns}p' -> 'p'."""
+    return tag.rpartition('}')[2]
+
+def place_id_from_uri(uri, name):
+    """Derive the app's place ID from a gazetteer URI."""
+    if 'pleiades.stoa.org/places/' in uri:
+        return uri.split('/places/')[-1]
+    elif 'geonames.org/' in uri:
+        return 'geonames-' + uri.split('/')[-1]
+    else:
+        return 'hestia-' + name.lower().replace(' ', '-')
+
+def collect_text(elem, pieces):
+    """
+    Append an element's text to pieces, in document order. Places that carry
+    a ref are appended as (place_id, name) tuples, everything else as strings.
+    """
+    if len(elem) == 0:
+        tag = local_name(elem.tag)
+        text = elem.text or ''
+        if tag == 'placeName':
+            uri = elem.get('ref')
+            if uri is not None:
+                pieces.append((place_id_from_uri(uri, text), text))
+                return
+        elif tag == 'note':
+            # Remove annotator notes entirely
+            return
+        pieces.append(text)
+        return
+
+    # Elements with children keep their text; children are handled in turn
+    pieces.append(elem.text or '')
+    for child in elem:
+        collect_text(child, pieces)
+        pieces.append(child.tail or '')
 
-    # Find book divisions by looking for "Book N" paragraphs
-    book_pattern = r'<p>Book (\d+)</p>'
+def extract_text_from_tei():
+    """
+    Stream the TEI body and return the text pieces of each book (see
+    collect_text). Books start at "Book N" paragraphs. Paragraphs are
+    flattened as soon as they are parsed and then cleared, so the whole tree
+    is never held at once.
+    """
     books_raw = {}
+    book_parts = None
+    in_body = False
+    found_body = False
 
-    # Split by book markers
-    parts = re.split(book_pattern, body)
+    for event, elem in ET.iterparse(TEI_PATH, events=('start', 'end')):
+        tag = local_name(elem.tag)
 
-    # parts[0] is before "Book 1", parts[1] is "1", parts[2] is content, etc.
-    for i in range(1, len(parts), 2):
-        if i + 1 < len(parts):
-            book_num = int(parts[i])
-            book_content = parts[i + 1]
-            books_raw[book_num] = book_content
+        if tag == 'body':
+            in_body = event == 'start'
+            found_body = True
+            continue
 
-    return books_raw
+        if event != 'end':
+            continue
 
-def clean_text(text):
-    """Remove XML tags but preserve text content, marking places."""
-    # First, extract place references and mark them
-    place_pattern = r'<placeName[^>]*ref="([^"]*)"[^>]*>([^<]*)</placeName>'
-
-    def replace_place(match):
-        uri = match.group(1)
-        name = match.group(2)
-        # Extract place ID from URI
-        place_id = None
-        if 'pleiades.stoa.org/places/' in uri:
-            place_id = uri.split('/places/')[-1]
-        elif 'geonames.org/' in uri:
-            place_id = 'geonames-' + uri.split('/')[-1]
-        else:
-            place_id = 'hestia-' + name.lower().replace(' ', '-')
-        return f'{{{{PLACE:{place_id}:{name}}}}}'
+        if tag == 'teiHeader':
+            # Only the body is used; drop the header (incl. its listPlace)
+            elem.clear()
+            continue
+
+        if not in_body:
+            continue
 
-    text = re.sub(place_pattern, replace_place, text)
+        if tag == 'p':
+            book_match = len(elem) == 0 and BOOK_RE.fullmatch(elem.text or '')
+            if book_match:
+                book_parts = []
+                books_raw[int(book_match.group(1))] = book_parts
+            elif book_parts is not None:
+                collect_text(elem, book_parts)
+            elem.clear()
+        elif tag == 'div':
+            elem.clear()
+
+    if not found_body:
+        raise ValueError("Could not find body in TEI")
 
-    # Handle placeName without ref
-    text = re.sub(r'<placeName[^>]*>([^<]*)</placeName>', r'\1', text)
+    return books_raw
 
-    # Remove persName tags, keeping content
-    text = re.sub(r'<persName[^>]*>([^<]*)</persName>', r'\1', text)
+def clean_text(pieces):
+    """
+    Join a book's text pieces, collapsing the whitespace left over from the
+    XML layout. Returns the text and a list of (offset, place_id, name) for
+    the places in it, so no place markers need to go through the text.
+    """
+    # Entities were already decoded by the XML parser. Runs of whitespace
+    # become one space, even across pieces, and the ends are stripped, as
+    # with re.sub(r'\s+', ' ', text).strip() on the joined text
+    clean_parts = []
+    places = []
+    clean_len = 0  # length of ''.join(clean_parts), kept as a running total
+    pending_space = False
 
-    # Remove note tags entirely
-    text = re.sub(r'<note[^>]*>[^<]*</note>', '', text)
+    for piece in pieces:
+        if isinstance(piece, tuple):
+            place_id, raw = piece
+        else:
+            place_id, raw = None, piece
 
-    # Remove other XML tags
-    text = re.sub(r'<[^>]+>', '', text)
+        words = raw.split()
+        if not words:
+            pending_space = pending_space or bool(raw)
+            continue
 
-    # Clean up whitespace
-    text = re.sub(r'\s+', ' ', text)
-    text = text.strip()
+        if (pending_space or raw[0].isspace()) and clean_parts:
+            clean_parts.append(' ')
+            clean_len += 1
 
-    # Unescape HTML entities
-    text = unescape(text)
+        text = ' '.join(words)
+        if place_id is not None:
+            places.append((clean_len, place_id, text))
+        clean_parts.append(text)
+        clean_len += len(text)
+        pending_space = raw[-1].isspace()
 
-    return text
+    return ''.join(clean_parts), places
 
-def divide_into_chapters(text):
+def divide_into_chapters(text, places):
     """
     Divide text into chapters based on chapter number markers in the text.
     Herodotus chapters are marked with numbers like "17." at the start of sections.
+    Returns {chapter_num: (chapter_text, chapter_places)}, where the places
+    from clean_text are given as dicts with offsets into the chapter text.
     """
     # Pattern to find chapter markers: number followed by period,
     # typically preceded by sentence-ending punctuation and space
@@ -103,28 +169,45 @@ def divide_into_chapters(text):
     # Include comma as it's used before some chapters
     # Include curly quotes (unicode 8220, 8221) and digits (for footnote numbers)
     # Also handle various other punctuation that may precede chapter numbers
-    chapter_pattern = r'(?<=[.!?"\':;,\u201c\u201d0-9]) (\d{1,3})\.'
+    # (see CHAPTER_RE)
+
+    place_offsets = [offset for offset, _, _ in places]
+
+    def chapter(start_pos, end_pos):
+        # Strip the chapter text, then pick out its places by offset
+        chapter_text = text[start_pos:end_pos]
+        stripped = chapter_text.lstrip()
+        start_pos += len(chapter_text) - len(stripped)
+        chapter_text = stripped.rstrip()
+        end_pos = start_pos + len(chapter_text)
+
+        first = bisect_left(place_offsets, start_pos)
+        last = bisect_left(place_offsets, end_pos)
+        chapter_places = [
+            {
+                'placeId': place_id,
+                'name': name,
+                'startOffset': offset - start_pos,
+                'endOffset': offset - start_pos + len(name)
+            }
+            for offset, place_id, name in places[first:last]
+        ]
+        return chapter_text, chapter_places
 
     # Find all chapter markers with their positions
-    markers = list(re.finditer(chapter_pattern, text))
+    markers = list(CHAPTER_RE.finditer(text))
 
     if not markers:
         # Fallback: return entire text as one chapter
-        return {1: text}
+        return {1: chapter(0, len(text))}
 
     chapters = {}
 
-    # Handle text before first marker (usually chapter 1 content)
-    first_marker = markers[0]
-    first_chapter_num = int(first_marker.group(1))
-
     # If text exists before the first numbered marker, it's chapter 1
-    pre_text = text[:first_marker.start()].strip()
-    if pre_text and first_chapter_num > 1:
-        chapters[1] = pre_text
-    elif pre_text:
-        # First marker is chapter 2 or higher, so pre_text is chapter 1
-        chapters[1] = pre_text
+    first_marker = markers[0]
+    pre_chapter = chapter(0, first_marker.start())
+    if pre_chapter[0]:
+        chapters[1] = pre_chapter
 
     # Process each marker
     for i, marker in enumerate(markers):
@@ -139,52 +222,23 @@ def divide_into_chapters(text):
         else:
             end_pos = len(text)
 
-        chapter_text = text[start_pos:end_pos].strip()
+        chapter_text, chapter_places = chapter(start_pos, end_pos)
 
         if chapter_text:
-            chapters[chapter_num] = chapter_text
+            chapters[chapter_num] = (chapter_text, chapter_places)
 
     return chapters
 
-def extract_places_from_text(text):
-    """Extract place markers from text and return both clean text and place list."""
-    places = []
-    pattern = r'\{\{PLACE:([^:]+):([^}]+)\}\}'
-
-    # Find all places with their positions
-    clean_parts = []
-    last_end = 0
-
-    for match in re.finditer(pattern, text):
-        # Add text before this place
-        clean_parts.append(text[last_end:match.start()])
-
-        place_id = match.group(1)
-        place_name = match.group(2)
-
-        # Calculate position in clean text
-        clean_pos = len(''.join(clean_parts))
-
-        places.append({
-            'placeId': place_id,
-            'name': place_name,
-            'startOffset': clean_pos,
-            'endOffset': clean_pos + len(place_name)
-        })
-
-        # Add the place name (not the marker)
-        clean_parts.append(place_name)
-        last_end = match.end()
-
-    # Add remaining text
-    clean_parts.append(text[last_end:])
-
-    return ''.join(clean_parts), places
+def write_json(path, data, **kwargs):
+    """Write data as indented JSON, serialised in one call and written at once."""
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(json.dumps(data, indent=2, **kwargs))
 
 def process_books(books_raw):
-    """Process all books and create JSON output."""
-    books_data = {}
-
+    """
+    Process all books and write their JSON output. Each book is written as
+    soon as it is built and not kept, so only one book is held in memory.
+    """
     for book_num in range(1, 10):
         if book_num not in books_raw:
             print(f"Warning: Book {book_num} not found in TEI")
@@ -193,10 +247,10 @@ def process_books(books_raw):
         print(f"Processing Book {book_num}...")
 
         # Clean the book text
-        clean_book = clean_text(books_raw[book_num])
+        clean_book, book_places = clean_text(books_raw[book_num])
 
         # Divide into chapters based on actual chapter markers
-        chapter_dict = divide_into_chapters(clean_book)
+        chapter_dict = divide_into_chapters(clean_book, book_places)
 
         # Get sorted chapter numbers
         chapter_nums = sorted(chapter_dict.keys())
@@ -205,16 +259,15 @@ def process_books(books_raw):
         # Process each chapter
         chapters = []
         for chapter_num in chapter_nums:
-            chapter_text = chapter_dict[chapter_num]
-            clean_chapter, places = extract_places_from_text(chapter_text)
+            chapter_text, places = chapter_dict[chapter_num]
 
             chapters.append({
                 'id': chapter_num,
-                'text': clean_chapter,
+                'text': chapter_text,
                 'places': places
             })
 
-        books_data[book_num] = {
+        book_data = {
             'id': book_num,
             'title': f"Book {book_num}: {BOOK_TITLES[book_num]}",
             'chapters': chapters
@@ -222,11 +275,24 @@ def process_books(books_raw):
 
         # Write individual book file with text
         output_file = OUTPUT_DIR / f'book-{book_num}-text.json'
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(books_data[book_num], f, indent=2, ensure_ascii=False)
+        write_json(output_file, book_data, ensure_ascii=False)
         print(f"  Wrote {output_file.name} ({len(chapters)} chapters)")
 
-    return books_data
+        # Write the chapter boundaries as [id, start, end] triples, so
+        # transform-data.py doesn't have to load the full text again
+        ends = list(accumulate(
+            len(chapter['text']) + 1  # +1 for space between chapters
+            for chapter in chapters
+        ))
+        starts = [0] + ends[:-1]
+        boundaries = [
+            [chapter['id'], start, end]
+            for chapter, start, end in zip(chapters, starts, ends)
+        ]
+
+        boundaries_file = OUTPUT_DIR / f'book-{book_num}-boundaries.json'
+        write_json(boundaries_file, boundaries)
+        print(f"  Wrote {boundaries_file.name}")
 
 def main():
     print("Extracting text from TEI XML...")
@@ -235,7 +301,7 @@ def main():
 
     print("\nProcessing books...")
     OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
-    books_data = process_books(books_raw)
+    process_books(books_raw)
 
     print("\nDone!")
 
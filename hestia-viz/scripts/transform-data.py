@@ -13,6 +13,7 @@ import csv
 import json
 import re
 import os
+from bisect import bisect_right
 from collections import defaultdict
 from pathlib import Path
 
@@ -33,23 +34,39 @@ BOOK_TITLES = {
     9: "Calliope"
 }
 
+# Regex patterns, compiled once at module load
+BOOK_RE = re.compile(r'Book (\d+)')
+CHAR_OFFSET_RE = re.compile(r'char-offset:(\d+)')
+
+# Kinds of annotation URI, classified once in parse_csv
+URI_PLEIADES, URI_GEONAMES, URI_OTHER = 0, 1, 2
+
+def load_boundaries(book_num):
+    """
+    Load the [id, start, end] chapter boundaries written by extract-text.py,
+    or None if the book hasn't been extracted.
+    """
+    boundaries_file = OUTPUT_DIR / f'book-{book_num}-boundaries.json'
+    if not boundaries_file.exists():
+        return None
+
+    with open(boundaries_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
 def load_chapter_info():
-    """Load chapter info from the generated text files."""
+    """Load chapter info from the generated chapter boundary files."""
     chapter_info = {}
 
     for book_num in range(1, 10):
-        text_file = OUTPUT_DIR / f'book-{book_num}-text.json'
-        if text_file.exists():
-            with open(text_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                chapters = data['chapters']
-                # Get list of actual chapter IDs
-                chapter_ids = sorted([ch['id'] for ch in chapters])
-                chapter_info[book_num] = {
-                    'count': len(chapters),
-                    'max_id': max(chapter_ids) if chapter_ids else 1,
-                    'chapter_ids': chapter_ids
-                }
+        boundaries = load_boundaries(book_num)
+        if boundaries is not None:
+            # Get list of actual chapter IDs
+            chapter_ids = sorted([chapter_id for chapter_id, _, _ in boundaries])
+            chapter_info[book_num] = {
+                'count': len(boundaries),
+                'max_id': max(chapter_ids) if chapter_ids else 1,
+                'chapter_ids': chapter_ids
+            }
         else:
             # Fallback
             chapter_info[book_num] = {
@@ -65,48 +82,72 @@ def parse_csv():
     annotations = []
 
     with open(CSV_PATH, 'r', encoding='utf-8') as f:
-        reader = csv.DictReader(f)
+        # Read rows as plain lists and look columns up by index, rather
+        # than building a dict per row with csv.DictReader
+        reader = csv.reader(f)
+        header = next(reader)
+        column = {name: i for i, name in enumerate(header)}
+        (uuid_col, file_col, quote_col, anchor_col, type_col, uri_col,
+         vocab_col, lat_col, lng_col, place_type_col, verification_col,
+         tags_col) = (column[name] for name in (
+             'UUID', 'FILE', 'QUOTE_TRANSCRIPTION', 'ANCHOR', 'TYPE', 'URI',
+             'VOCAB_LABEL', 'LAT', 'LNG', 'PLACE_TYPE', 'VERIFICATION_STATUS',
+             'TAGS'))
+        width = len(header)
+
         for row in reader:
+            if len(row) < width:
+                # Missing trailing fields read as None, as with DictReader
+                row.extend([None] * (width - len(row)))
+
             # Only process PLACE type annotations with coordinates
-            if row['TYPE'] == 'PLACE' and row['LAT'] and row['LNG']:
+            if row[type_col] == 'PLACE' and row[lat_col] and row[lng_col]:
                 # Extract book number from FILE column
-                book_match = re.search(r'Book (\d+)', row['FILE'])
+                book_match = BOOK_RE.search(row[file_col])
                 if not book_match:
                     continue
 
                 book_num = int(book_match.group(1))
 
                 # Extract character offset
-                offset_match = re.search(r'char-offset:(\d+)', row['ANCHOR'])
+                offset_match = CHAR_OFFSET_RE.search(row[anchor_col])
                 if not offset_match:
                     continue
 
                 char_offset = int(offset_match.group(1))
 
+                quote = row[quote_col]
+                vocab_label = row[vocab_col]
+                tags = row[tags_col] or ''
+
                 # Extract place ID from URI
                 place_id = None
-                uri = row['URI']
+                uri = row[uri_col]
                 if 'pleiades.stoa.org/places/' in uri:
                     place_id = uri.split('/places/')[-1]
+                    uri_kind = URI_PLEIADES
                 elif 'geonames.org/' in uri:
                     place_id = 'geonames-' + uri.split('/')[-1]
+                    uri_kind = URI_GEONAMES
                 else:
                     # Generate ID from name for unidentified places
-                    place_id = 'hestia-' + row['QUOTE_TRANSCRIPTION'].lower().replace(' ', '-')
+                    place_id = 'hestia-' + quote.lower().replace(' ', '-')
+                    uri_kind = URI_OTHER
 
                 annotations.append({
-                    'uuid': row['UUID'],
+                    'uuid': row[uuid_col],
                     'book': book_num,
-                    'quote': row['QUOTE_TRANSCRIPTION'],
+                    'quote': quote,
                     'char_offset': char_offset,
                     'place_id': place_id,
                     'uri': uri,
-                    'label': row['VOCAB_LABEL'].split('|')[0] if row['VOCAB_LABEL'] else row['QUOTE_TRANSCRIPTION'],
-                    'lat': float(row['LAT']),
-                    'lng': float(row['LNG']),
-                    'place_type': row['PLACE_TYPE'],
-                    'verified': row['VERIFICATION_STATUS'] == 'VERIFIED',
-                    'is_ethnic': 'Ethnic' in (row['TAGS'] or '') or 'ethnic' in (row['TAGS'] or '')
+                    'uri_kind': uri_kind,
+                    'label': vocab_label.split('|')[0] if vocab_label else quote,
+                    'lat': float(row[lat_col]),
+                    'lng': float(row[lng_col]),
+                    'place_type': row[place_type_col],
+                    'verified': row[verification_col] == 'VERIFIED',
+                    'is_ethnic': 'Ethnic' in tags or 'ethnic' in tags
                 })
 
     return annotations
@@ -124,8 +165,8 @@ def build_places_gazetteer(annotations):
                 'name': ann['label'] or ann['quote'],
                 'lat': ann['lat'],
                 'lng': ann['lng'],
-                'pleiadesUri': ann['uri'] if 'pleiades' in ann['uri'] else None,
-                'geonamesUri': ann['uri'] if 'geonames' in ann['uri'] else None,
+                'pleiadesUri': ann['uri'] if ann['uri_kind'] == URI_PLEIADES else None,
+                'geonamesUri': ann['uri'] if ann['uri_kind'] == URI_GEONAMES else None,
                 'placeType': ann['place_type'],
                 'isEthnic': ann['is_ethnic'],
                 'occurrences': []
@@ -143,40 +184,30 @@ def build_places_gazetteer(annotations):
 def assign_chapters_to_annotations(annotations, chapter_info):
     """
     Assign chapter numbers to annotations based on character offset.
-    Uses the actual chapter text to find boundaries.
+    Uses the chapter boundaries of the extracted text.
     """
-    # Load full text for each book to build character offset -> chapter mapping
+    # Group annotations by book in one pass, rather than filtering the
+    # full list again for every book
+    annotations_by_book = defaultdict(list)
+    for ann in annotations:
+        annotations_by_book[ann['book']].append(ann)
+
+    # Load chapter boundaries for each book to map character offset -> chapter
     for book_num in range(1, 10):
-        text_file = OUTPUT_DIR / f'book-{book_num}-text.json'
-        if not text_file.exists():
+        book_annotations = annotations_by_book.get(book_num)
+        if not book_annotations:
             continue
 
-        with open(text_file, 'r', encoding='utf-8') as f:
-            book_data = json.load(f)
-
-        # Build cumulative character offset for each chapter
-        # We'll estimate which chapter an annotation belongs to
-        chapters = book_data['chapters']
-
-        # Calculate total text length and chapter boundaries
-        cumulative_len = 0
-        chapter_boundaries = []
-        for ch in chapters:
-            start = cumulative_len
-            cumulative_len += len(ch['text']) + 1  # +1 for space between chapters
-            chapter_boundaries.append({
-                'id': ch['id'],
-                'start': start,
-                'end': cumulative_len
-            })
+        boundaries = load_boundaries(book_num)
+        if not boundaries:
+            # No chapters: annotations fall back to chapter 1 downstream
+            continue
 
-        total_len = cumulative_len
+        # Chapter start offsets, in the concatenated text of the book
+        chapter_ids, chapter_starts, chapter_ends = zip(*boundaries)
+        total_len = chapter_ends[-1]
 
         # Get max char offset for this book from annotations
-        book_annotations = [a for a in annotations if a['book'] == book_num]
-        if not book_annotations:
-            continue
-
         max_offset = max(a['char_offset'] for a in book_annotations)
 
         # Scale factor to map annotation offsets to our text
@@ -186,18 +217,11 @@ def assign_chapters_to_annotations(annotations, chapter_info):
         for ann in book_annotations:
             scaled_offset = ann['char_offset'] * scale
 
-            # Find which chapter this offset falls into
-            assigned_chapter = 1
-            for boundary in chapter_boundaries:
-                if boundary['start'] <= scaled_offset < boundary['end']:
-                    assigned_chapter = boundary['id']
-                    break
-            else:
-                # If not found, use last chapter
-                if chapter_boundaries:
-                    assigned_chapter = chapter_boundaries[-1]['id']
-
-            ann['chapter'] = assigned_chapter
+            # Find which chapter this offset falls into: the last chapter
+            # starting at or before it (offsets past the end land in the
+            # last chapter)
+            index = bisect_right(chapter_starts, scaled_offset) - 1
+            ann['chapter'] = chapter_ids[index]
 
     return annotations
 
@@ -215,26 +239,38 @@ def build_books_data(annotations, chapter_info, places):
                 'title': f"Book {book_num}: {BOOK_TITLES[book_num]}",
                 'chapterCount': chapter_info[book_num]['count'],
                 'maxChapterId': chapter_info[book_num]['max_id'],
-                'chapters': defaultdict(lambda: {'places': []})
+                'placeCount': 0,
+                'chapters': {}
             }
 
         # Add place reference to chapter
-        books[book_num]['chapters'][chapter_num]['places'].append({
+        chapters = books[book_num]['chapters']
+        chapters.setdefault(chapter_num, {'places': []})['places'].append({
             'placeId': ann['place_id'],
             'name': ann['quote'],
             'charOffset': ann['char_offset']
         })
+        books[book_num]['placeCount'] += 1
+
+    # Update occurrences in places with chapter info, indexing them by
+    # (place, book, offset) so each annotation is a single lookup
+    occurrence_index = defaultdict(list)
+    for place_id, place in places.items():
+        for occ in place['occurrences']:
+            occurrence_index[(place_id, occ['book'], occ['charOffset'])].append(occ)
 
-    # Update occurrences in places with chapter info
     for ann in annotations:
-        place = places.get(ann['place_id'])
-        if place:
-            for occ in place['occurrences']:
-                if occ['book'] == ann['book'] and occ['charOffset'] == ann['char_offset']:
-                    occ['chapter'] = ann.get('chapter', 1)
+        key = (ann['place_id'], ann['book'], ann['char_offset'])
+        for occ in occurrence_index.get(key, ()):
+            occ['chapter'] = ann.get('chapter', 1)
 
     return books
 
+def write_json(path, data, **kwargs):
+    """Write data as indented JSON, serialised in one call and written at once."""
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(json.dumps(data, indent=2, **kwargs))
+
 def write_output(books, places, chapter_info):
     """Write all output JSON files."""
     OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
@@ -247,17 +283,13 @@ def write_output(books, places, chapter_info):
                 'title': f"Book {book_num}: {BOOK_TITLES[book_num]}",
                 'chapterCount': chapter_info[book_num]['count'],
                 'maxChapterId': chapter_info[book_num]['max_id'],
-                'placeCount': sum(
-                    len(ch['places'])
-                    for ch in books.get(book_num, {}).get('chapters', {}).values()
-                )
+                'placeCount': books[book_num]['placeCount'] if book_num in books else 0
             }
             for book_num in range(1, 10)
         ]
     }
 
-    with open(OUTPUT_DIR / 'books.json', 'w', encoding='utf-8') as f:
-        json.dump(books_index, f, indent=2)
+    write_json(OUTPUT_DIR / 'books.json', books_index)
     print(f"Wrote books.json")
 
     # Write individual book files
@@ -277,8 +309,7 @@ def write_output(books, places, chapter_info):
                     'places': sorted(chapter_data['places'], key=lambda x: x['charOffset'])
                 })
 
-            with open(OUTPUT_DIR / f'book-{book_num}.json', 'w', encoding='utf-8') as f:
-                json.dump(book_data, f, indent=2)
+            write_json(OUTPUT_DIR / f'book-{book_num}.json', book_data)
             print(f"Wrote book-{book_num}.json ({len(book_data['chapters'])} chapters with places)")
 
     # Write places.json
@@ -303,8 +334,7 @@ def write_output(books, places, chapter_info):
             'occurrences': clean_occurrences
         }
 
-    with open(OUTPUT_DIR / 'places.json', 'w', encoding='utf-8') as f:
-        json.dump({'places': places_output}, f, indent=2)
+    write_json(OUTPUT_DIR / 'places.json', {'places': places_output})
     print(f"Wrote places.json ({len(places_output)} places)")
 
 def main():